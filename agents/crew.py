@@ -4,143 +4,59 @@ Multi-Agent System for Brain Tumor Analysis
 
 from langchain_groq import ChatGroq
 from langchain.prompts import PromptTemplate
-from typing import Dict
+from typing import Dict, Generator, Iterator, Tuple
+import numpy as np
+import os
+import threading
 from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from models.classifier import BrainTumorClassifier
 from agents.knowledge_base import get_knowledge_base
+from agents.llm_cache import ReportCache, report_cache_key
 from config import Config
 
+# Section markers used to split the combined explanation + report response
+EXPLANATION_MARK = '===EXPLANATION==='
+REPORT_MARK = '===REPORT==='
 
-class BrainTumorCrew:
-    """
-    Multi-agent system for brain tumor analysis
-    
-    Agent 1: Classification - Binary classification (Tumor vs Normal) with Grad-CAM visualization
-    Agent 2: Explanation - Medical context from Neo4j knowledge graph + LLM analysis
-    Agent 3: Report Generation - Comprehensive medical report synthesis
-    """
-    
-    def __init__(self, config: Config):
-        self.config = config
-        
-        self.llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            api_key=config.GROQ_API_KEY
-        )
-        
-        # Initialize classifier and knowledge base
-        self.classifier = BrainTumorClassifier(config.MODEL_PATH)
-        self.classifier.load_model()
-        
-        self.kb = get_knowledge_base(
-            config.NEO4J_URI,
-            config.NEO4J_USERNAME,
-            config.NEO4J_PASSWORD
-        )
-    
-    def agent_classify(self, image_path: str) -> Dict:
-        """Agent 1: Classification Agent - Binary tumor detection with Grad-CAM visualization"""
-        # Run classification
-        result = self.classifier.predict(image_path)
-        
-        # Generate Grad-CAM
-        gradcam_path = image_path.replace('.', '_gradcam.')
-        self.classifier.save_gradcam(image_path, gradcam_path)
-        
-        # Create classification report
-        report = f"""
+# Agent 1 and Agent 2 reports, filled in per request
+CLASSIFICATION_REPORT_TEMPLATE = """
 AGENT 1 - CLASSIFICATION REPORT
 ================================
 
 MRI Image Analysis Complete
 
-Diagnosis: {result['class']}
-Confidence Level: {result['confidence']:.1%}
-Tumor Detected: {'Yes' if result['tumor_detected'] else 'No'}
-Raw Prediction Score: {result['raw_prediction']:.4f}
+Diagnosis: {diagnosis}
+Confidence Level: {confidence:.1%}
+Tumor Detected: {tumor_detected}
+Raw Prediction Score: {raw_prediction:.4f}
 
 Explainability Analysis:
-- Grad-CAM visualization has been generated
-- Heatmap shows which brain regions influenced the classification decision
-- Visualization saved to: {gradcam_path}
+- Grad-CAM heatmap shows which brain regions influenced the classification decision
+- Visualization {gradcam_status}
 
 Model Information:
 - Architecture: VGG19 Transfer Learning
 - Training: Binary classification (Tumor vs Normal)
 - Confidence Threshold: 0.5
 """
-        
-        return {
-            'report': report,
-            'classification': result,
-            'gradcam_path': gradcam_path
-        }
-    
-    def agent_explain(self, classification_result: Dict) -> Dict:
-        """Agent 2: Explanation Agent - Queries Neo4j knowledge graph and generates medical insights"""
-        # Query knowledge base
-        kb_info = self.kb.query_tumor_information(classification_result['tumor_detected'])
-        
-        # Create prompt for LLM
-        prompt = PromptTemplate(
-            input_variables=["diagnosis", "confidence", "kb_info"],
-            template="""You are a medical expert providing comprehensive analysis of brain MRI results.
 
-Classification Results:
-- Diagnosis: {diagnosis}
-- Confidence: {confidence}
+KNOWLEDGE_REPORT_TEMPLATE = """
+AGENT 2 - MEDICAL KNOWLEDGE
+===========================
 
-Medical Knowledge Base Information:
 {kb_info}
 
-Please provide a comprehensive medical explanation including:
-1. What this diagnosis means in medical terms
-2. Common symptoms and warning signs
-3. Possible causes and risk factors
-4. Available treatment options
-5. Recommended next steps
-6. Important medical considerations
-
-Write in clear, professional medical language while being understandable."""
-        )
-        
-        kb_str = str(kb_info)
-        
-        formatted_prompt = prompt.format(
-            diagnosis=classification_result['class'],
-            confidence=f"{classification_result['confidence']:.1%}",
-            kb_info=kb_str
-        )
-        
-        # Get LLM response
-        explanation = self.llm.invoke(formatted_prompt).content
-        
-        report = f"""
-AGENT 2 - MEDICAL EXPLANATION
-==============================
-
-{explanation}
-
 Knowledge Base Statistics:
-- Symptoms Identified: {len(kb_info.get('symptoms', []))}
-- Risk Factors: {len(kb_info.get('causes', []))}
-- Treatment Options: {len(kb_info.get('treatments', []))}
+- Symptoms Identified: {symptoms}
+- Risk Factors: {causes}
+- Treatment Options: {treatments}
 """
-        
-        return {
-            'report': report,
-            'kb_info': kb_info,
-            'explanation': explanation
-        }
-    
-    def agent_report(self, classification_data: Dict, explanation_data: Dict, patient_info: Dict = None) -> str:
-        """Agent 3: Report Generation Agent - Synthesizes comprehensive medical report"""
-        # Create comprehensive report prompt
-        prompt = PromptTemplate(
-            input_variables=["patient_info", "classification", "explanation", "timestamp"],
-            template="""You are a medical documentation specialist creating a comprehensive medical report.
+
+# A single prompt covers both the explanation and the final report, saving a
+# full round trip to the LLM
+REPORT_PROMPT_TEMPLATE = """You are a medical expert and documentation specialist analyzing brain MRI results.
 
 Patient Information:
 {patient_info}
@@ -148,12 +64,24 @@ Patient Information:
 Classification Results:
 {classification}
 
-Medical Analysis:
-{explanation}
+Medical Knowledge Base Information:
+{kb_info}
 
-Report Timestamp: {timestamp}
+Respond with exactly two sections, each introduced by its marker on a line of its own.
+
+===EXPLANATION===
+A comprehensive medical explanation including:
+1. What this diagnosis means in medical terms
+2. Common symptoms and warning signs
+3. Possible causes and risk factors
+4. Available treatment options
+5. Recommended next steps
+6. Important medical considerations
 
-Generate a complete, professionally formatted medical report with the following sections:
+Write in clear, professional medical language while being understandable.
+
+===REPORT===
+A complete, professionally formatted medical report, building on the explanation above, with the following sections:
 
 # COMPREHENSIVE BRAIN MRI ANALYSIS REPORT
 
@@ -182,8 +110,158 @@ Generate a complete, professionally formatted medical report with the following
 [Medical disclaimers and limitations]
 
 Format the report professionally with clear sections and bullet points where appropriate."""
+
+
+class BrainTumorCrew:
+    """
+    Multi-agent system for brain tumor analysis
+    
+    Agent 1: Classification - Binary classification (Tumor vs Normal) with Grad-CAM visualization
+    Agent 2: Explanation - Medical context from Neo4j knowledge graph
+    Agent 3: Report Generation - LLM medical explanation and comprehensive report (one call)
+    """
+    
+    def __init__(self, config: Config):
+        self.config = config
+        
+        self.llm = ChatGroq(
+            model="llama-3.3-70b-versatile",
+            temperature=0.7,
+            api_key=config.GROQ_API_KEY
+        )
+        
+        # Parse the prompt template once rather than per request
+        self.report_prompt = PromptTemplate(
+            input_variables=["patient_info", "classification", "kb_info"],
+            template=REPORT_PROMPT_TEMPLATE
+        )
+        
+        # Initialize classifier and knowledge base
+        self.classifier = BrainTumorClassifier(
+            config.MODEL_PATH,
+            config.CLASSIFIER_BACKEND,
+            config.PREDICTION_CACHE_FOLDER
+        )
+        self.classifier.load_model()
+        self.classifier.warmup()
+        
+        self.kb = get_knowledge_base(
+            config.NEO4J_URI,
+            config.NEO4J_USERNAME,
+            config.NEO4J_PASSWORD
         )
         
+        # Reports for equivalent cases are reused instead of regenerated
+        self.report_cache = ReportCache(config.LLM_CACHE_SIZE)
+        
+        # Background worker for knowledge base lookups
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        
+        # Grad-CAM renders get their own workers, so several seconds of VGG19
+        # work never queue ahead of anything else
+        self.gradcam_executor = ThreadPoolExecutor(max_workers=2)
+        
+        # Grad-CAM renders in progress, by output path, so concurrent requests
+        # for the same scan share one render
+        self._gradcam_jobs = {}
+        self._gradcam_lock = threading.Lock()
+        
+        # Fill the knowledge base cache off the request path
+        self.executor.submit(self.kb.query_tumor_information, True)
+    
+    def agent_classify(self, image_path: str, gradcam: bool = True) -> Dict:
+        """
+        Agent 1: Classification Agent - Binary tumor detection with Grad-CAM visualization
+        
+        The Grad-CAM pass runs in the background so it overlaps with the report
+        generation; 'gradcam_future' completes once the visualization is saved.
+        With gradcam=False it is skipped and can be produced later with ensure_gradcam.
+        """
+        # Run classification (served from the prediction cache for known scans);
+        # on a miss the decoded image is reused for Grad-CAM
+        result, img_array = self.classifier.predict_with_input(image_path)
+        
+        # Generate Grad-CAM
+        gradcam_path = gradcam_path_for(image_path)
+        gradcam_future = None
+        if gradcam:
+            gradcam_future = self._gradcam_job(image_path, img_array)
+            gradcam_status = f"saved to: {gradcam_path}"
+        else:
+            gradcam_status = "generated on request"
+        
+        # Create classification report
+        report = CLASSIFICATION_REPORT_TEMPLATE.format(
+            diagnosis=result['class'],
+            confidence=result['confidence'],
+            tumor_detected='Yes' if result['tumor_detected'] else 'No',
+            raw_prediction=result['raw_prediction'],
+            gradcam_status=gradcam_status
+        )
+        
+        return {
+            'report': report,
+            'classification': result,
+            'gradcam_path': gradcam_path,
+            'gradcam_future': gradcam_future
+        }
+    
+    def ensure_gradcam(self, image_path: str) -> str:
+        """Generate the Grad-CAM visualization for an image unless it already exists"""
+        gradcam_path = gradcam_path_for(image_path)
+        if os.path.exists(gradcam_path):
+            return gradcam_path
+        return self._gradcam_job(image_path).result()
+    
+    def _gradcam_job(self, image_path: str, img_array: np.ndarray = None) -> Future:
+        """Render the Grad-CAM visualization in the background, joining a render already in progress"""
+        gradcam_path = gradcam_path_for(image_path)
+        with self._gradcam_lock:
+            future = self._gradcam_jobs.get(gradcam_path)
+            if future is not None:
+                return future
+            future = self.gradcam_executor.submit(self._save_gradcam, image_path, gradcam_path, img_array)
+            self._gradcam_jobs[gradcam_path] = future
+        future.add_done_callback(lambda done: self._finish_gradcam_job(gradcam_path, done))
+        return future
+    
+    def _finish_gradcam_job(self, gradcam_path: str, future: Future):
+        """Forget a finished render, so a failed one can be retried"""
+        with self._gradcam_lock:
+            if self._gradcam_jobs.get(gradcam_path) is future:
+                del self._gradcam_jobs[gradcam_path]
+    
+    def _save_gradcam(self, image_path: str, gradcam_path: str, img_array: np.ndarray = None) -> str:
+        """Save the Grad-CAM visualization unless an identical scan already has one"""
+        if not os.path.exists(gradcam_path):
+            self.classifier.save_gradcam(image_path, gradcam_path, img_array=img_array)
+        return gradcam_path
+    
+    def agent_explain(self, classification_result: Dict, kb_info: Dict = None) -> Dict:
+        """Agent 2: Explanation Agent - Queries Neo4j knowledge graph for medical context"""
+        # Query knowledge base (unless already fetched by the caller)
+        if kb_info is None:
+            kb_info = self.kb.query_tumor_information(classification_result['tumor_detected'])
+        
+        report = KNOWLEDGE_REPORT_TEMPLATE.format(
+            kb_info=kb_info,
+            symptoms=len(kb_info.get('symptoms', [])),
+            causes=len(kb_info.get('causes', [])),
+            treatments=len(kb_info.get('treatments', []))
+        )
+        
+        return {
+            'report': report,
+            'kb_info': kb_info
+        }
+    
+    def agent_report(self, classification_data: Dict, explanation_data: Dict, patient_info: Dict = None) -> Generator[Tuple[str, str], None, Dict]:
+        """
+        Agent 3: Report Generation Agent - Medical explanation and comprehensive report in one LLM call
+        
+        Yields ('report_chunk', text) events while the report is being generated and
+        returns a dictionary with the 'explanation' and 'report' sections.
+        """
         patient_str = "No patient information provided"
         if patient_info:
             patient_str = f"""
@@ -192,61 +270,131 @@ Age: {patient_info.get('age', 'N/A')}
 Gender: {patient_info.get('gender', 'N/A')}
 """
         
-        formatted_prompt = prompt.format(
+        formatted_prompt = self.report_prompt.format(
             patient_info=patient_str,
             classification=classification_data['report'],
-            explanation=explanation_data['report'],
-            timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            kb_info=explanation_data['report']
         )
         
-        # Get final report from LLM
-        final_report = self.llm.invoke(formatted_prompt).content
+        # The prompt holds every case detail the LLM can write about, so a
+        # cached response is only reused for an identical prompt
+        cache_key = report_cache_key(formatted_prompt)
+        cached = self.report_cache.get(cache_key)
+        if cached is not None:
+            yield 'report_chunk', cached['report']
+            return cached
+        
+        # Stream the response, forwarding the report section as it is written
+        response = ''
+        sent = None  # Offset of the first report character not yet yielded
+        for chunk in self.llm.stream(formatted_prompt):
+            response += chunk.content
+            if sent is None:
+                marker = response.find(REPORT_MARK)
+                if marker == -1:
+                    continue
+                sent = marker + len(REPORT_MARK)
+            if len(response) > sent:
+                yield 'report_chunk', response[sent:]
+                sent = len(response)
         
-        return final_report
+        explanation, final_report = split_llm_response(response)
+        
+        report_data = {
+            'explanation': explanation,
+            'report': final_report
+        }
+        self.report_cache.set(cache_key, report_data)
+        return report_data
     
-    def analyze(self, image_path: str, patient_info: Dict = None) -> Dict:
+    def analyze_stream(self, image_path: str, patient_info: Dict = None,
+                       gradcam: bool = True) -> Iterator[Tuple[str, object]]:
         """
-        Run the complete multi-agent analysis workflow
+        Run the complete multi-agent analysis workflow, yielding events as it progresses
         
         Args:
             image_path: Path to the MRI image
             patient_info: Optional patient information
+            gradcam: Whether to generate the Grad-CAM visualization
             
-        Returns:
-            Complete analysis results
+        Yields:
+            ('classification', classification result) once Agent 1 is done,
+            ('report_chunk', text) for each piece of the report as the LLM writes it,
+            ('complete', complete analysis results) at the end
         """
         print("\n" + "="*60)
         print("MULTI-AGENT BRAIN TUMOR ANALYSIS SYSTEM")
         print("="*60 + "\n")
         
+        # One timestamp for the whole analysis, shared by the results and the report file
+        now = datetime.now()
+        
         # Step 1: Classification Agent
         print("🤖 Agent 1: Running classification analysis...")
-        classification_data = self.agent_classify(image_path)
+        classification_data = self.agent_classify(image_path, gradcam)
         print("✓ Classification complete")
+        yield 'classification', classification_data['classification']
         
         # Step 2: Medical Explanation Agent
-        print("\n🧑‍⚕️ Agent 2: Generating medical explanation...")
+        print("\n🧑‍⚕️ Agent 2: Gathering medical context...")
+        # Served from the knowledge base cache, filled when the crew starts
         explanation_data = self.agent_explain(classification_data['classification'])
-        print("✓ Medical explanation complete")
+        print("✓ Medical context gathered")
         
         # Step 3: Report Generation Agent
-        print("\n📋 Agent 3: Generating comprehensive report...")
-        final_report = self.agent_report(classification_data, explanation_data, patient_info)
+        print("\n📋 Agent 3: Generating medical explanation and report...")
+        report_data = yield from self.agent_report(classification_data, explanation_data, patient_info)
         print("✓ Report generation complete")
         
+        # Grad-CAM was rendered while the LLM was writing
+        if classification_data['gradcam_future'] is not None:
+            classification_data['gradcam_future'].result()
+        
         print("\n" + "="*60)
         print("ANALYSIS COMPLETE")
         print("="*60 + "\n")
         
         # Compile results
-        return {
-            'timestamp': datetime.now().isoformat(),
+        yield 'complete', {
+            'timestamp': now.isoformat(),
             'image_path': image_path,
             'patient_info': patient_info,
             'classification': classification_data['classification'],
-            'report': final_report,
+            'explanation': report_data['explanation'],
+            'report': report_data['report'],
             'gradcam_path': classification_data['gradcam_path']
         }
+    
+    def analyze(self, image_path: str, patient_info: Dict = None, gradcam: bool = True) -> Dict:
+        """
+        Run the complete multi-agent analysis workflow
+        
+        Args:
+            image_path: Path to the MRI image
+            patient_info: Optional patient information
+            gradcam: Whether to generate the Grad-CAM visualization
+            
+        Returns:
+            Complete analysis results
+        """
+        for event, data in self.analyze_stream(image_path, patient_info, gradcam):
+            if event == 'complete':
+                return data
+
+
+def gradcam_path_for(image_path: str) -> str:
+    """Path of the Grad-CAM visualization for an MRI image"""
+    base, extension = os.path.splitext(image_path)
+    return f"{base}_gradcam{extension}"
+
+
+def split_llm_response(response: str) -> Tuple[str, str]:
+    """Split a combined LLM response into its explanation and report sections"""
+    explanation, marker, report = response.partition(REPORT_MARK)
+    if not marker:
+        # Model ignored the section markers; treat everything as the report
+        return '', response.strip()
+    return explanation.replace(EXPLANATION_MARK, '').strip(), report.strip()
 
 
 def create_crew(config: Config = None) -> BrainTumorCrew:
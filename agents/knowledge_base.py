@@ -6,10 +6,125 @@ from neo4j import GraphDatabase
 from neo4j.exceptions import ServiceUnavailable
 from typing import List, Dict
 import logging
+import threading
+import time
+import weakref
 
 logger = logging.getLogger(__name__)
 
 
+# Seconds a query_tumor_information result is reused before it is fetched
+# again, so a re-seed by another process or worker is picked up
+TUMOR_INFO_TTL = 300
+
+# Labels of the seeded nodes, all keyed by their name property
+NODE_LABELS = ['TumorType', 'Symptom', 'Cause', 'Treatment', 'Diagnostic']
+
+# Seed data for initialize_knowledge_base
+TUMOR_TYPES = [
+    {
+        'name': 'Glioma',
+        'description': 'Tumors that arise from glial cells in the brain',
+        'prevalence': 'Most common primary brain tumor in adults'
+    },
+    {
+        'name': 'Meningioma',
+        'description': 'Tumors that develop from the meninges',
+        'prevalence': 'Most common benign brain tumor'
+    },
+    {
+        'name': 'Pituitary Adenoma',
+        'description': 'Tumors of the pituitary gland',
+        'prevalence': 'Common, usually benign'
+    }
+]
+
+SYMPTOMS = [
+    {'name': 'Persistent Headaches', 'severity': 'High'},
+    {'name': 'Seizures', 'severity': 'High'},
+    {'name': 'Vision Problems', 'severity': 'Medium'},
+    {'name': 'Nausea and Vomiting', 'severity': 'Medium'},
+    {'name': 'Muscle Weakness', 'severity': 'High'},
+    {'name': 'Cognitive Changes', 'severity': 'Medium'},
+    {'name': 'Balance Problems', 'severity': 'Medium'}
+]
+
+CAUSES = [
+    {'name': 'Previous Radiation Exposure', 'type': 'Environmental'},
+    {'name': 'Genetic Mutations', 'type': 'Genetic'},
+    {'name': 'Family History', 'type': 'Genetic'},
+    {'name': 'Age (Risk increases with age)', 'type': 'Demographic'},
+    {'name': 'Weakened Immune System', 'type': 'Medical'}
+]
+
+TREATMENTS = [
+    {
+        'name': 'Surgical Resection',
+        'description': 'Removal of tumor through surgery',
+        'effectiveness': 'High for accessible tumors'
+    },
+    {
+        'name': 'Radiation Therapy',
+        'description': 'Use of high-energy radiation to kill tumor cells',
+        'effectiveness': 'High when combined with other treatments'
+    },
+    {
+        'name': 'Chemotherapy',
+        'description': 'Drug-based treatment to kill cancer cells',
+        'effectiveness': 'Variable depending on tumor type'
+    },
+    {
+        'name': 'Targeted Therapy',
+        'description': 'Drugs targeting specific molecular changes in tumor cells',
+        'effectiveness': 'Growing effectiveness for specific tumor types'
+    }
+]
+
+DIAGNOSTICS = [
+    {
+        'name': 'MRI Scan',
+        'description': 'Magnetic Resonance Imaging for detailed brain images',
+        'accuracy': 'Very High'
+    },
+    {
+        'name': 'CT Scan',
+        'description': 'Computed Tomography for brain imaging',
+        'accuracy': 'High'
+    },
+    {
+        'name': 'Biopsy',
+        'description': 'Tissue sample analysis for definitive diagnosis',
+        'accuracy': 'Gold Standard'
+    }
+]
+
+TUMOR_SYMPTOMS = [
+    {'tumor': 'Glioma', 'symptom': 'Persistent Headaches', 'frequency': 'Common'},
+    {'tumor': 'Glioma', 'symptom': 'Seizures', 'frequency': 'Common'},
+    {'tumor': 'Glioma', 'symptom': 'Cognitive Changes', 'frequency': 'Frequent'},
+    {'tumor': 'Glioma', 'symptom': 'Muscle Weakness', 'frequency': 'Common'}
+]
+
+TUMOR_CAUSES = [
+    {'cause': 'Previous Radiation Exposure', 'tumor': 'Glioma', 'risk_factor': 'Moderate'},
+    {'cause': 'Genetic Mutations', 'tumor': 'Glioma', 'risk_factor': 'High'},
+    {'cause': 'Family History', 'tumor': 'Glioma', 'risk_factor': 'Moderate'}
+]
+
+TUMOR_TREATMENTS = [
+    {'tumor': 'Glioma', 'treatment': 'Surgical Resection', 'priority': 'Primary'},
+    {'tumor': 'Glioma', 'treatment': 'Radiation Therapy', 'priority': 'Adjuvant'},
+    {'tumor': 'Glioma', 'treatment': 'Chemotherapy', 'priority': 'Adjuvant'},
+    {'tumor': 'Glioma', 'treatment': 'Targeted Therapy', 'priority': 'Emerging'}
+]
+
+TUMOR_DIAGNOSTICS = [
+    {'diagnostic': 'MRI Scan', 'tumor': 'Glioma', 'accuracy': 'Primary method'},
+    {'diagnostic': 'CT Scan', 'tumor': 'Glioma', 'accuracy': 'Secondary method'},
+    {'diagnostic': 'Biopsy', 'tumor': 'Glioma', 'accuracy': 'Confirmatory'}
+]
+
+
 class MedicalKnowledgeBase:
     """Neo4j-based medical knowledge base for brain tumors"""
     
@@ -22,173 +137,149 @@ class MedicalKnowledgeBase:
             username: Database username
             password: Database password
         """
-        self.driver = GraphDatabase.driver(uri, auth=(username, password), encrypted=False)
-        import time
-        last_err = None
-        for attempt in range(5):
+        self.driver = GraphDatabase.driver(
+            uri,
+            auth=(username, password),
+            encrypted=False,
+            connection_timeout=5,
+            connection_acquisition_timeout=10
+        )
+        self._verify_connectivity()
+        
+        # (query_tumor_information result, fetch time) keyed by the tumor flag
+        self._tumor_info_cache = {}
+        
+        # One reusable session per thread (sessions are not thread-safe)
+        self._local = threading.local()
+        self._sessions = weakref.WeakSet()
+        
+    def _verify_connectivity(self, attempts: int = 5, delay: float = 0.5):
+        """Verify the database is reachable, backing off exponentially between attempts"""
+        for attempt in range(1, attempts + 1):
             try:
                 self.driver.verify_connectivity()
-                last_err = None
-                break
+                return
             except Exception as e:
-                last_err = e
-                logger.warning(f"Neo4j connectivity attempt {attempt+1}/5 failed: {e}")
-                time.sleep(2)
-        if last_err:
-            raise last_err
-        
+                if attempt == attempts:
+                    raise
+                logger.warning(f"Neo4j connectivity attempt {attempt}/{attempts} failed: {e}")
+                time.sleep(delay)
+                delay *= 2
+    
+    def _session(self):
+        """Get the calling thread's session, opening it on first use"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self.driver.session()
+            self._local.session = session
+            self._sessions.add(session)
+        return session
+    
     def close(self):
-        """Close the database connection"""
+        """Close the open sessions and the database connection"""
+        for session in list(self._sessions):
+            session.close()
         self.driver.close()
     
     def initialize_knowledge_base(self):
         """Initialize the knowledge base with medical information about brain tumors"""
-        with self.driver.session() as session:
-            # Clear existing data (optional - for fresh start)
-            session.run("MATCH (n) DETACH DELETE n")
-            
-            # Create brain tumor types
-            session.run("""
-                CREATE (glioma:TumorType {
-                    name: 'Glioma',
-                    description: 'Tumors that arise from glial cells in the brain',
-                    prevalence: 'Most common primary brain tumor in adults'
-                })
-                CREATE (meningioma:TumorType {
-                    name: 'Meningioma',
-                    description: 'Tumors that develop from the meninges',
-                    prevalence: 'Most common benign brain tumor'
-                })
-                CREATE (pituitary:TumorType {
-                    name: 'Pituitary Adenoma',
-                    description: 'Tumors of the pituitary gland',
-                    prevalence: 'Common, usually benign'
-                })
-            """)
-            
-            # Create symptoms
-            session.run("""
-                CREATE (headache:Symptom {name: 'Persistent Headaches', severity: 'High'})
-                CREATE (seizures:Symptom {name: 'Seizures', severity: 'High'})
-                CREATE (vision:Symptom {name: 'Vision Problems', severity: 'Medium'})
-                CREATE (nausea:Symptom {name: 'Nausea and Vomiting', severity: 'Medium'})
-                CREATE (weakness:Symptom {name: 'Muscle Weakness', severity: 'High'})
-                CREATE (cognitive:Symptom {name: 'Cognitive Changes', severity: 'Medium'})
-                CREATE (balance:Symptom {name: 'Balance Problems', severity: 'Medium'})
-            """)
-            
-            # Create causes/risk factors
-            session.run("""
-                CREATE (radiation:Cause {name: 'Previous Radiation Exposure', type: 'Environmental'})
-                CREATE (genetic:Cause {name: 'Genetic Mutations', type: 'Genetic'})
-                CREATE (family:Cause {name: 'Family History', type: 'Genetic'})
-                CREATE (age:Cause {name: 'Age (Risk increases with age)', type: 'Demographic'})
-                CREATE (immune:Cause {name: 'Weakened Immune System', type: 'Medical'})
-            """)
-            
-            # Create treatments
-            session.run("""
-                CREATE (surgery:Treatment {
-                    name: 'Surgical Resection',
-                    description: 'Removal of tumor through surgery',
-                    effectiveness: 'High for accessible tumors'
-                })
-                CREATE (radio:Treatment {
-                    name: 'Radiation Therapy',
-                    description: 'Use of high-energy radiation to kill tumor cells',
-                    effectiveness: 'High when combined with other treatments'
-                })
-                CREATE (chemo:Treatment {
-                    name: 'Chemotherapy',
-                    description: 'Drug-based treatment to kill cancer cells',
-                    effectiveness: 'Variable depending on tumor type'
-                })
-                CREATE (targeted:Treatment {
-                    name: 'Targeted Therapy',
-                    description: 'Drugs targeting specific molecular changes in tumor cells',
-                    effectiveness: 'Growing effectiveness for specific tumor types'
-                })
-            """)
-            
-            # Create diagnostic methods
-            session.run("""
-                CREATE (mri:Diagnostic {
-                    name: 'MRI Scan',
-                    description: 'Magnetic Resonance Imaging for detailed brain images',
-                    accuracy: 'Very High'
-                })
-                CREATE (ct:Diagnostic {
-                    name: 'CT Scan',
-                    description: 'Computed Tomography for brain imaging',
-                    accuracy: 'High'
-                })
-                CREATE (biopsy:Diagnostic {
-                    name: 'Biopsy',
-                    description: 'Tissue sample analysis for definitive diagnosis',
-                    accuracy: 'Gold Standard'
-                })
-            """)
-            
-            # Create relationships between tumor types and symptoms
-            session.run("""
-                MATCH (g:TumorType {name: 'Glioma'})
-                MATCH (headache:Symptom {name: 'Persistent Headaches'})
-                MATCH (seizures:Symptom {name: 'Seizures'})
-                MATCH (cognitive:Symptom {name: 'Cognitive Changes'})
-                MATCH (weakness:Symptom {name: 'Muscle Weakness'})
-                CREATE (g)-[:CAUSES_SYMPTOM {frequency: 'Common'}]->(headache)
-                CREATE (g)-[:CAUSES_SYMPTOM {frequency: 'Common'}]->(seizures)
-                CREATE (g)-[:CAUSES_SYMPTOM {frequency: 'Frequent'}]->(cognitive)
-                CREATE (g)-[:CAUSES_SYMPTOM {frequency: 'Common'}]->(weakness)
-            """)
-            
-            # Create relationships with causes
-            session.run("""
-                MATCH (g:TumorType {name: 'Glioma'})
-                MATCH (radiation:Cause {name: 'Previous Radiation Exposure'})
-                MATCH (genetic:Cause {name: 'Genetic Mutations'})
-                MATCH (family:Cause {name: 'Family History'})
-                CREATE (radiation)-[:INCREASES_RISK_OF {risk_factor: 'Moderate'}]->(g)
-                CREATE (genetic)-[:INCREASES_RISK_OF {risk_factor: 'High'}]->(g)
-                CREATE (family)-[:INCREASES_RISK_OF {risk_factor: 'Moderate'}]->(g)
-            """)
-            
-            # Create relationships with treatments
-            session.run("""
-                MATCH (g:TumorType {name: 'Glioma'})
-                MATCH (surgery:Treatment {name: 'Surgical Resection'})
-                MATCH (radio:Treatment {name: 'Radiation Therapy'})
-                MATCH (chemo:Treatment {name: 'Chemotherapy'})
-                MATCH (targeted:Treatment {name: 'Targeted Therapy'})
-                CREATE (g)-[:TREATED_WITH {priority: 'Primary'}]->(surgery)
-                CREATE (g)-[:TREATED_WITH {priority: 'Adjuvant'}]->(radio)
-                CREATE (g)-[:TREATED_WITH {priority: 'Adjuvant'}]->(chemo)
-                CREATE (g)-[:TREATED_WITH {priority: 'Emerging'}]->(targeted)
-            """)
-            
-            # Create relationships with diagnostics
-            session.run("""
-                MATCH (g:TumorType {name: 'Glioma'})
-                MATCH (mri:Diagnostic {name: 'MRI Scan'})
-                MATCH (ct:Diagnostic {name: 'CT Scan'})
-                MATCH (biopsy:Diagnostic {name: 'Biopsy'})
-                CREATE (mri)-[:DIAGNOSES {accuracy: 'Primary method'}]->(g)
-                CREATE (ct)-[:DIAGNOSES {accuracy: 'Secondary method'}]->(g)
-                CREATE (biopsy)-[:DIAGNOSES {accuracy: 'Confirmatory'}]->(g)
-            """)
-            
-            logger.info("Knowledge base initialized successfully")
+        session = self._session()
+        
+        # Unique names per label: the backing index turns the MERGE and MATCH
+        # lookups into index seeks (schema changes cannot share a transaction
+        # with data writes)
+        for label in NODE_LABELS:
+            session.run(
+                f"CREATE CONSTRAINT {label.lower()}_name_unique IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.name IS UNIQUE"
+            )
+        
+        session.execute_write(self._create_knowledge_graph)
+        
+        # Drop results cached from the previous contents
+        self._tumor_info_cache.clear()
+        
+        logger.info("Knowledge base initialized successfully")
+    
+    @staticmethod
+    def _create_knowledge_graph(tx):
+        """
+        Write the seed data in one transaction, one parameterized batch per node/relationship type
+        
+        Everything is merged on name, so re-running it updates the seed data in
+        place without touching anything else stored in the database.
+        """
+        # Create or update nodes
+        tx.run("UNWIND $rows AS row MERGE (n:TumorType {name: row.name}) SET n += row", rows=TUMOR_TYPES)
+        tx.run("UNWIND $rows AS row MERGE (n:Symptom {name: row.name}) SET n += row", rows=SYMPTOMS)
+        tx.run("UNWIND $rows AS row MERGE (n:Cause {name: row.name}) SET n += row", rows=CAUSES)
+        tx.run("UNWIND $rows AS row MERGE (n:Treatment {name: row.name}) SET n += row", rows=TREATMENTS)
+        tx.run("UNWIND $rows AS row MERGE (n:Diagnostic {name: row.name}) SET n += row", rows=DIAGNOSTICS)
+        
+        # Create or update relationships between tumor types and symptoms
+        tx.run("""
+            UNWIND $rows AS row
+            MATCH (t:TumorType {name: row.tumor})
+            MATCH (s:Symptom {name: row.symptom})
+            MERGE (t)-[r:CAUSES_SYMPTOM]->(s)
+            SET r.frequency = row.frequency
+        """, rows=TUMOR_SYMPTOMS)
+        
+        # Create relationships with causes
+        tx.run("""
+            UNWIND $rows AS row
+            MATCH (c:Cause {name: row.cause})
+            MATCH (t:TumorType {name: row.tumor})
+            MERGE (c)-[r:INCREASES_RISK_OF]->(t)
+            SET r.risk_factor = row.risk_factor
+        """, rows=TUMOR_CAUSES)
+        
+        # Create relationships with treatments
+        tx.run("""
+            UNWIND $rows AS row
+            MATCH (t:TumorType {name: row.tumor})
+            MATCH (tr:Treatment {name: row.treatment})
+            MERGE (t)-[r:TREATED_WITH]->(tr)
+            SET r.priority = row.priority
+        """, rows=TUMOR_TREATMENTS)
+        
+        # Create relationships with diagnostics
+        tx.run("""
+            UNWIND $rows AS row
+            MATCH (d:Diagnostic {name: row.diagnostic})
+            MATCH (t:TumorType {name: row.tumor})
+            MERGE (d)-[r:DIAGNOSES]->(t)
+            SET r.accuracy = row.accuracy
+        """, rows=TUMOR_DIAGNOSTICS)
     
     def query_tumor_information(self, tumor_detected: bool) -> Dict:
         """
         Query comprehensive information about brain tumors
         
+        The result for each flag is shared for TUMOR_INFO_TTL seconds (callers
+        must not mutate it). A result from a graph that has not been seeded yet
+        is never cached, so the seed data shows up as soon as it is written.
+        
         Args:
             tumor_detected: Whether a tumor was detected
             
         Returns:
             Dictionary containing medical information
         """
+        tumor_detected = bool(tumor_detected)
+        cached = self._tumor_info_cache.get(tumor_detected)
+        if cached is not None and time.monotonic() - cached[1] < TUMOR_INFO_TTL:
+            return cached[0]
+        
+        info = self._fetch_tumor_information(tumor_detected)
+        if tumor_detected and not any(info[key] for key in ('symptoms', 'causes', 'treatments', 'diagnostics')):
+            logger.warning("Knowledge base is empty; run /init-knowledge-base to seed it")
+        else:
+            self._tumor_info_cache[tumor_detected] = (info, time.monotonic())
+        return info
+    
+    def _fetch_tumor_information(self, tumor_detected: bool) -> Dict:
+        """Run the knowledge base queries behind query_tumor_information"""
         if not tumor_detected:
             return {
                 'status': 'Normal',
@@ -200,74 +291,65 @@ class MedicalKnowledgeBase:
                 ]
             }
         
-        with self.driver.session() as session:
-            # Query symptoms
-            symptoms_result = session.run("""
+        # Symptoms, causes, treatments and diagnostics in a single round trip
+        record = self._session().run("""
+            CALL {
                 MATCH (t:TumorType)-[r:CAUSES_SYMPTOM]->(s:Symptom)
-                RETURN s.name as symptom, s.severity as severity, r.frequency as frequency
-            """)
-            symptoms = [dict(record) for record in symptoms_result]
-            
-            # Query causes
-            causes_result = session.run("""
+                RETURN collect({symptom: s.name, severity: s.severity, frequency: r.frequency}) AS symptoms
+            }
+            CALL {
                 MATCH (c:Cause)-[r:INCREASES_RISK_OF]->(t:TumorType)
-                RETURN c.name as cause, c.type as type, r.risk_factor as risk
-            """)
-            causes = [dict(record) for record in causes_result]
-            
-            # Query treatments
-            treatments_result = session.run("""
+                RETURN collect({cause: c.name, type: c.type, risk: r.risk_factor}) AS causes
+            }
+            CALL {
                 MATCH (t:TumorType)-[r:TREATED_WITH]->(tr:Treatment)
-                RETURN tr.name as treatment, tr.description as description, 
-                       tr.effectiveness as effectiveness, r.priority as priority
+                WITH tr, r
                 ORDER BY 
                     CASE r.priority 
                         WHEN 'Primary' THEN 1 
                         WHEN 'Adjuvant' THEN 2 
                         ELSE 3 
                     END
-            """)
-            treatments = [dict(record) for record in treatments_result]
-            
-            # Query diagnostics
-            diagnostics_result = session.run("""
+                RETURN collect({treatment: tr.name, description: tr.description,
+                                effectiveness: tr.effectiveness, priority: r.priority}) AS treatments
+            }
+            CALL {
                 MATCH (d:Diagnostic)-[r:DIAGNOSES]->(t:TumorType)
-                RETURN d.name as method, d.description as description, d.accuracy as accuracy
-            """)
-            diagnostics = [dict(record) for record in diagnostics_result]
-            
-            return {
-                'status': 'Tumor Detected',
-                'symptoms': symptoms,
-                'causes': causes,
-                'treatments': treatments,
-                'diagnostics': diagnostics,
-                'recommendations': [
-                    'Immediate consultation with a neurologist or neurosurgeon',
-                    'Additional diagnostic tests (biopsy) for tumor characterization',
-                    'Discussion of treatment options based on tumor type and location',
-                    'Consider second opinion from specialized cancer center'
-                ]
+                RETURN collect({method: d.name, description: d.description, accuracy: d.accuracy}) AS diagnostics
             }
+            RETURN symptoms, causes, treatments, diagnostics
+        """).single()
+        
+        return {
+            'status': 'Tumor Detected',
+            'symptoms': record['symptoms'],
+            'causes': record['causes'],
+            'treatments': record['treatments'],
+            'diagnostics': record['diagnostics'],
+            'recommendations': [
+                'Immediate consultation with a neurologist or neurosurgeon',
+                'Additional diagnostic tests (biopsy) for tumor characterization',
+                'Discussion of treatment options based on tumor type and location',
+                'Consider second opinion from specialized cancer center'
+            ]
+        }
     
     def get_symptoms_by_severity(self, severity: str) -> List[str]:
         """Get symptoms filtered by severity"""
-        with self.driver.session() as session:
-            result = session.run("""
-                MATCH (s:Symptom {severity: $severity})
-                RETURN s.name as symptom
-            """, severity=severity)
-            return [record['symptom'] for record in result]
+        result = self._session().run("""
+            MATCH (s:Symptom {severity: $severity})
+            RETURN s.name as symptom
+        """, severity=severity)
+        return [record['symptom'] for record in result]
     
     def get_treatment_recommendations(self) -> List[Dict]:
         """Get all treatment recommendations"""
-        with self.driver.session() as session:
-            result = session.run("""
-                MATCH (t:TumorType)-[r:TREATED_WITH]->(tr:Treatment)
-                RETURN t.name as tumor_type, tr.name as treatment, 
-                       tr.description as description, r.priority as priority
-            """)
-            return [dict(record) for record in result]
+        result = self._session().run("""
+            MATCH (t:TumorType)-[r:TREATED_WITH]->(tr:Treatment)
+            RETURN t.name as tumor_type, tr.name as treatment, 
+                   tr.description as description, r.priority as priority
+        """)
+        return [dict(record) for record in result]
 
 
 # Singleton instance
@@ -0,0 +1,63 @@
+"""
+In-process cache for LLM-generated medical reports
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+import hashlib
+import threading
+
+
+def report_cache_key(prompt: str) -> str:
+    """
+    Build the cache key for a report
+    
+    The key is a digest of the full prompt, so a report is only reused for a
+    case with the same classification report, knowledge base context and
+    patient details; it never carries another case's scores or information.
+    
+    Args:
+        prompt: Formatted report prompt
+        
+    Returns:
+        Hashable cache key
+    """
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class ReportCache:
+    """Thread-safe LRU cache of generated reports"""
+    
+    def __init__(self, maxsize: int = 128):
+        """
+        Initialize the cache
+        
+        Args:
+            maxsize: Maximum number of reports kept; 0 disables caching
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[Dict]:
+        """Get a cached report, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+    
+    def set(self, key: Hashable, value: Dict):
+        """Store a report, evicting the least recently used one when full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Remove all cached reports"""
+        with self._lock:
+            self._entries.clear()
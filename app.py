@@ -3,12 +3,17 @@ Flask Web Application for Brain Tumor Analysis
 Multi-Agent System
 """
 
-from flask import Flask, render_template, request, jsonify, send_from_directory, session
+from flask import Flask, Request, Response, abort, current_app, render_template, request, jsonify, send_from_directory, session, stream_with_context
+from flask.json.provider import JSONProvider
 import os
+import re
+import tempfile
 from werkzeug.utils import secure_filename
-import json
+import orjson
+from blake3 import blake3
 from datetime import datetime
 import logging
+import threading
 
 from config import Config
 from agents.crew import create_crew
@@ -17,32 +22,173 @@ from agents.knowledge_base import get_knowledge_base
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider using orjson for jsonify and request parsing"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class UploadRequest(Request):
+    """Request that spools uploaded files to disk in the upload folder
+    
+    The parser writes each file part straight to a temporary file next to its
+    final location, so saving an upload is a rename rather than another copy.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_temp_paths = []
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = tempfile.NamedTemporaryFile(
+            'wb+', dir=current_app.config['UPLOAD_FOLDER'], prefix='.upload-', delete=False
+        )
+        self.upload_temp_paths.append(stream.name)
+        return stream
+    
+    def close(self):
+        super().close()
+        # Remove spooled files that were not saved
+        for path in self.upload_temp_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ORJSONProvider(app)
+app.request_class = UploadRequest
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['REPORTS_FOLDER'], exist_ok=True)
-os.makedirs('static/results', exist_ok=True)
 
 crew = None
+crew_lock = threading.Lock()
+
+extensions_pattern = '|'.join(map(re.escape, sorted(app.config['ALLOWED_EXTENSIONS'])))
+
+# Matches filenames ending in one of the allowed extensions, e.g. '.png'
+# (\Z rather than $, which would also match before a trailing newline)
+allowed_file_re = re.compile(r'\.(' + extensions_pattern + r')\Z', re.IGNORECASE)
+
+# Names save_upload gives to uploaded scans: 128-bit content hash + extension
+upload_name_re = re.compile(r'[0-9a-f]{32}\.(' + extensions_pattern + r')\Z')
 
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+def file_extension(filename):
+    """Lowercase extension of a filename if it is allowed, otherwise None"""
+    match = allowed_file_re.search(filename)
+    return match.group(1).lower() if match else None
 
 
 def get_crew():
     """Lazy load the crew instance"""
     global crew
     if crew is None:
-        logger.info("Initializing multi-agent system...")
-        crew = create_crew()
-        logger.info("Crew initialized successfully")
+        with crew_lock:
+            if crew is None:
+                logger.info("Initializing multi-agent system...")
+                crew = create_crew()
+                logger.info("Crew initialized successfully")
     return crew
 
 
+def warm_up_crew():
+    """Build the crew ahead of the first request"""
+    try:
+        get_crew()
+    except Exception as e:
+        logger.warning(f"Crew warm-up failed, retrying on first request: {str(e)}")
+
+
+def stream_analysis(analysis_crew, filepath, patient_info, include_gradcam):
+    """Run the analysis, yielding its progress as Server-Sent Events"""
+    try:
+        for event, data in analysis_crew.analyze_stream(filepath, patient_info, include_gradcam):
+            if event == 'complete':
+                report_path = save_analysis(data, filepath)
+                data = {
+                    'success': True,
+                    'result': data,
+                    'report_path': report_path
+                }
+            yield sse_event(event, data)
+    
+    except Exception as e:
+        logger.error(f"Analysis error: {str(e)}", exc_info=True)
+        yield sse_event('error', {'error': str(e)})
+
+
+def save_upload(file, extension):
+    """
+    Store an uploaded file under its content hash and return its path
+    
+    Identical scans map to the same file, so a re-upload is not stored twice
+    and reuses the Grad-CAM visualization already made for it.
+    """
+    temp_path = getattr(file.stream, 'name', None)
+    if temp_path in request.upload_temp_paths:
+        file.stream.close()
+    else:
+        # Not spooled to disk by UploadRequest; write it out first
+        with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], prefix='.upload-', delete=False) as f:
+            request.upload_temp_paths.append(f.name)
+            file.save(f)
+        temp_path = f.name
+    
+    digest = blake3(max_threads=blake3.AUTO)
+    digest.update_mmap(temp_path)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{digest.hexdigest(length=16)}.{extension}")
+    
+    if os.path.exists(filepath):
+        logger.info(f"Duplicate upload, reusing: {filepath}")
+    else:
+        os.replace(temp_path, filepath)
+    return filepath
+
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+def save_analysis(result, filepath):
+    """Save the JSON report and add the image URLs for the web interface"""
+    # Save the report, named after the analysis' own timestamp
+    stamp = datetime.fromisoformat(result['timestamp']).strftime('%Y%m%d_%H%M%S')
+    report_filename = f"report_{stamp}.json"
+    report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
+    
+    with open(report_path, 'wb') as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    
+    logger.info(f"Analysis completed. Report saved to: {report_path}")
+    
+    # Images are served straight from the upload folder
+    base = os.path.basename(filepath)
+    result['image_url'] = f"/uploads/{base}"
+    if os.path.exists(result['gradcam_path']):
+        result['gradcam_url'] = f"/uploads/{os.path.basename(result['gradcam_path'])}"
+    else:
+        result['gradcam_url'] = f"/gradcam/{base}"
+    
+    return report_path
+
+
+@app.before_request
+def limit_content_length():
+    """Reject oversized requests from their Content-Length, before any of the body is read"""
+    if request.content_length is not None and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        abort(413)
+
+
 @app.route('/')
 def index():
     """Home page"""
@@ -62,16 +208,12 @@ def upload_file():
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
         
-        if file and allowed_file(file.filename):
-            # Secure the filename
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            # Save the file
-            file.save(filepath)
-            logger.info(f"File uploaded: {filepath}")
+        extension = file_extension(file.filename)
+        if file and extension:
+            # Save the file, named after its content
+            filepath = save_upload(file, extension)
+            filename = os.path.basename(filepath)
+            logger.info(f"File uploaded: {secure_filename(file.filename)} -> {filepath}")
             
             # Get optional patient info
             patient_info = None
@@ -116,6 +258,9 @@ def analyze():
         else:
             patient_info = session.get('patient_info')
         
+        # Grad-CAM is computed on demand via /gradcam unless requested up front
+        include_gradcam = incoming.get('gradcam') in (True, 1, '1', 'true')
+        
         if not filepath or not os.path.exists(filepath):
             return jsonify({'error': 'No image file found. Please upload an image first.'}), 400
         
@@ -123,34 +268,17 @@ def analyze():
         
         # Get the crew and run analysis
         analysis_crew = get_crew()
-        result = analysis_crew.analyze(filepath, patient_info)
-        
-        # Save the report
-        report_filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
         
-        with open(report_path, 'w') as f:
-            json.dump(result, f, indent=2)
+        # Clients that accept an event stream get the report as it is written
+        if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+            return Response(
+                stream_with_context(stream_analysis(analysis_crew, filepath, patient_info, include_gradcam)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
-        logger.info(f"Analysis completed. Report saved to: {report_path}")
-        
-        # Move gradcam to static folder for web access
-        if os.path.exists(result['gradcam_path']):
-            gradcam_filename = os.path.basename(result['gradcam_path'])
-            static_gradcam_path = os.path.join('static', 'results', gradcam_filename)
-            os.makedirs(os.path.dirname(static_gradcam_path), exist_ok=True)
-            
-            # Copy file
-            import shutil
-            shutil.copy2(result['gradcam_path'], static_gradcam_path)
-            result['gradcam_url'] = f"/static/results/{gradcam_filename}"
-        
-        # Move original image to static folder
-        original_filename = os.path.basename(filepath)
-        static_original_path = os.path.join('static', 'results', original_filename)
-        import shutil
-        shutil.copy2(filepath, static_original_path)
-        result['image_url'] = f"/static/results/{original_filename}"
+        result = analysis_crew.analyze(filepath, patient_info, include_gradcam)
+        report_path = save_analysis(result, filepath)
         
         return jsonify({
             'success': True,
@@ -163,6 +291,29 @@ def analyze():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """Serve an uploaded scan or its Grad-CAM visualization"""
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True)
+
+
+@app.route('/gradcam/<filename>')
+def gradcam(filename):
+    """Generate (once) and serve the Grad-CAM visualization of an uploaded image"""
+    try:
+        # Only uploaded scans, never generated images (or a Grad-CAM of a Grad-CAM)
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if not upload_name_re.match(filename) or not os.path.exists(filepath):
+            return jsonify({'error': 'Image not found'}), 404
+        
+        gradcam_path = get_crew().ensure_gradcam(filepath)
+        return send_from_directory(app.config['UPLOAD_FOLDER'], os.path.basename(gradcam_path), conditional=True)
+    
+    except Exception as e:
+        logger.error(f"Grad-CAM error: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/reports/<filename>')
 def download_report(filename):
     """Download a specific report"""
@@ -200,6 +351,15 @@ def too_large(e):
     return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
 
 
+# Load the model and connect to Neo4j in the background at startup (in each
+# worker under a WSGI server). With the debug reloader of `python app.py`, only
+# the child process that serves requests warms up.
+if app.config['PRELOAD_CREW'] and (
+    __name__ != '__main__' or not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+):
+    threading.Thread(target=warm_up_crew, daemon=True).start()
+
+
 if __name__ == '__main__':
     # Check if model exists
     if not os.path.exists(app.config['MODEL_PATH']):
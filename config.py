@@ -15,11 +15,20 @@ class Config:
     
     SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
     DEBUG = os.getenv('FLASK_DEBUG', 'True') == 'True'
+    PRELOAD_CREW = os.getenv('PRELOAD_CREW', 'True') == 'True'
     
     # Model Configuration
     
     MODEL_PATH = 'models/best_modelVGG19_brain_tumor.keras'
+    # 'keras', 'tflite-int8' / 'tflite-float16' for a quantized copy of the model,
+    # or 'onnx-int8' for the ONNX Runtime model made by quantize_onnx.py
+    CLASSIFIER_BACKEND = os.getenv('CLASSIFIER_BACKEND', 'keras')
     UPLOAD_FOLDER = 'uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     REPORTS_FOLDER = 'reports'
+    # Classification results of previously seen scans (empty disables the cache)
+    PREDICTION_CACHE_FOLDER = os.getenv('PREDICTION_CACHE_FOLDER', 'cache/predictions')
+    
+    # Number of generated reports kept in memory (0 disables the cache)
+    LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '128'))
@@ -5,34 +5,247 @@ Brain Tumor Classification Model
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
-from tensorflow.keras.preprocessing import image
 import cv2
-import matplotlib.pyplot as plt
-from typing import Dict
+from blake3 import blake3
+from typing import Dict, List, Optional, Tuple
+import functools
+import json
 import os
+import tempfile
+import threading
+
+# Inference backends: the Keras model itself, a post-training quantized TFLite
+# copy of it, or a statically quantized ONNX export (Grad-CAM always uses the
+# Keras model)
+BACKENDS = ('keras', 'tflite-int8', 'tflite-float16', 'onnx-int8')
+
+
+# Default Grad-CAM layer: the last convolutional layer of VGG19
+GRADCAM_LAYER = 'block5_conv4'
+
+
+def onnx_model_path(model_path: str) -> str:
+    """Path of the int8 ONNX model written by quantize_onnx.py for a Keras model"""
+    return f"{os.path.splitext(model_path)[0]}_int8.onnx"
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write a file through a temporary file in the same folder, so readers never see it half written"""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix='.tmp-', suffix=os.path.splitext(path)[1]
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _load_image(img_path: tf.Tensor, img_size: Tuple[int, int]) -> tf.Tensor:
+    """Decode, resize and normalize a single image file to an (*img_size, 3) tensor"""
+    contents = tf.io.read_file(img_path)
+    # Decode and resize like keras' load_img (PIL): JPEGs with the accurate
+    # integer IDCT rather than TF's default fast one, then nearest neighbour
+    img = tf.cond(
+        tf.io.is_jpeg(contents),
+        lambda: tf.io.decode_jpeg(contents, channels=3, dct_method='INTEGER_ACCURATE'),
+        lambda: tf.io.decode_image(contents, channels=3, expand_animations=False)
+    )
+    img = tf.image.resize(img, img_size, method='nearest')
+    # Scale in float32 by the reciprocal: one multiply per pixel, no float64 upcast
+    return tf.cast(img, tf.float32) * np.float32(1.0 / 255.0)  # Normalize to [0, 1]
+
+
+@functools.lru_cache(maxsize=4)
+def _build_preprocess(img_size: Tuple[int, int]):
+    """Graph that decodes, resizes, scales and batches one image, shared between classifiers"""
+    return tf.function(
+        lambda img_path: _load_image(img_path, img_size)[tf.newaxis],
+        input_signature=[tf.TensorSpec([], tf.string)]
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _build_infer(model: keras.Model, img_size: Tuple[int, int]):
+    """XLA-compiled forward pass of a model, shared between classifiers so it is traced once"""
+    return tf.function(
+        lambda x: model(x, training=False),
+        jit_compile=True,
+        input_signature=[tf.TensorSpec((None, *img_size, 3), tf.float32)]
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _load_keras_model(model_path: str, mtime: float) -> keras.Model:
+    """Load a Keras model once per path (and file version) and share it between classifiers"""
+    return keras.models.load_model(model_path)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_onnx_session(onnx_path: str, mtime: float):
+    """Create an ONNX Runtime session once per model file and share it between classifiers"""
+    import onnxruntime as ort  # Optional dependency, only needed for the onnx-int8 backend
+    
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = os.cpu_count()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(onnx_path, sess_options, providers=['CPUExecutionProvider'])
+
+
+@functools.lru_cache(maxsize=4)
+def _build_gradcam_core(model: keras.Model, last_conv_layer_name: str):
+    """XLA-compiled Grad-CAM pass of a model, returning the normalized heatmap of one image"""
+    # Model that maps the input image to the activations of the last conv layer
+    grad_model = keras.models.Model(
+        model.inputs,
+        [model.get_layer(last_conv_layer_name).output, model.output]
+    )
+    
+    @tf.function(jit_compile=True, input_signature=[tf.TensorSpec([1, *model.input_shape[1:]], tf.float32)])
+    def _gradcam_core(img_tensor):
+        # Compute gradient of the predicted class with respect to the output feature map
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = grad_model(img_tensor, training=False)
+            loss = predictions[:, 0]
+        grads = tape.gradient(loss, conv_outputs)
+        
+        # Global average pooling
+        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+        
+        # Weight the channels by the corresponding gradients
+        heatmap = conv_outputs[0] @ pooled_grads[..., tf.newaxis]
+        heatmap = tf.squeeze(heatmap)
+        
+        # Normalize heatmap (all zeros, not NaN, when nothing activates positively)
+        heatmap = tf.nn.relu(heatmap)
+        return heatmap / (tf.math.reduce_max(heatmap) + 1e-8)
+    
+    return _gradcam_core
+
 
 class BrainTumorClassifier:
     """Binary brain tumor classification using VGG19 model (Tumor vs Normal)"""
     
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, backend: str = 'keras', cache_dir: str = None):
         """
         Initialize the classifier
         
         Args:
             model_path: Path to the trained Keras model
+            backend: Inference backend used by predict, one of BACKENDS
+            cache_dir: Folder where predict stores its results by image content, None to disable
         """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        
         self.model_path = model_path
+        self.backend = backend
         self.model = None
+        self._infer = None
+        self._gradcam_core = None
+        self._interpreter = None
+        self._interpreter_lock = threading.Lock()
+        self._ort_session = None
+        self.cache_dir = cache_dir
+        self._model_tag = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
         self.img_size = (224, 224)
         self.class_names = ['Normal', 'Tumor']
         
+        # BGR colours of the JET colormap for each heatmap intensity
+        self._jet_lut = cv2.applyColorMap(
+            np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET
+        )[:, 0].copy()
+        
+        # Decoding, resizing, scaling and batching run as one TF graph
+        self._tf_preprocess = _build_preprocess(self.img_size)
+        
     def load_model(self):
         """Load the trained model"""
         if not os.path.exists(self.model_path):
             raise FileNotFoundError(f"Model not found at {self.model_path}")
         
-        self.model = keras.models.load_model(self.model_path)
+        self.model = _load_keras_model(self.model_path, os.path.getmtime(self.model_path))
+        
+        # XLA-compiled forward pass for the fixed input shape
+        self._infer = _build_infer(self.model, self.img_size)
+        
+        # Grad-CAM graph for the default layer, built once per loaded model
+        self._gradcam_core = _build_gradcam_core(self.model, GRADCAM_LAYER)
+        
+        inference_path = self.model_path
+        if self.backend.startswith('tflite'):
+            inference_path = self._load_tflite()
+        elif self.backend == 'onnx-int8':
+            inference_path = self._load_onnx()
+        
+        # Identifies the model version in prediction cache keys
+        stat = os.stat(inference_path)
+        self._model_tag = f"{self.backend}:{os.path.abspath(inference_path)}:{stat.st_mtime_ns}:{stat.st_size}"
         print(f"Model loaded successfully from {self.model_path}")
+    
+    def warmup(self):
+        """
+        Run the prediction and Grad-CAM passes once on a blank image
+        
+        Traces and XLA-compiles both graphs (and initializes the inference
+        backend) up front, so the first real request does not pay for it.
+        """
+        if self.model is None:
+            self.load_model()
+        
+        blank = np.zeros((1, *self.img_size, 3), np.float32)
+        self.predict_array(blank)
+        self._gradcam_core(blank)
+    
+    def _load_tflite(self):
+        """Load the quantized TFLite model, converting the Keras model when it is missing or stale"""
+        tflite_path = f"{os.path.splitext(self.model_path)[0]}_{self.backend.split('-', 1)[1]}.tflite"
+        
+        if not os.path.exists(tflite_path) or os.path.getmtime(tflite_path) < os.path.getmtime(self.model_path):
+            print(f"Quantizing model to {tflite_path}...")
+            converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+            # Dynamic range quantization: int8 weights, float activations
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            if self.backend == 'tflite-float16':
+                # float16 weights instead, for half the size at near-float32 accuracy
+                converter.target_spec.supported_types = [tf.float16]
+            # Other workers may be loading the previous file, so replace it atomically
+            _write_atomic(tflite_path, converter.convert())
+        
+        self._interpreter = tf.lite.Interpreter(model_path=tflite_path, num_threads=os.cpu_count())
+        self._interpreter.allocate_tensors()
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        return tflite_path
+    
+    def _load_onnx(self):
+        """Load the int8 ONNX model produced offline by quantize_onnx.py"""
+        onnx_path = onnx_model_path(self.model_path)
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(
+                f"Quantized ONNX model not found at {onnx_path}, run quantize_onnx.py first"
+            )
+        
+        self._ort_session = _load_onnx_session(onnx_path, os.path.getmtime(onnx_path))
+        self._ort_input_name = self._ort_session.get_inputs()[0].name
+        return onnx_path
+    
+    def _predict_onnx(self, img_array: np.ndarray) -> np.ndarray:
+        """Run the int8 ONNX model on a batch of preprocessed images"""
+        # Sessions are safe to run from several threads at once
+        return self._ort_session.run(None, {self._ort_input_name: np.asarray(img_array, np.float32)})[0]
+    
+    def _predict_tflite(self, img_array: np.ndarray) -> np.ndarray:
+        """Run the quantized model on a single preprocessed image"""
+        # The interpreter holds per-call state, so calls must not overlap
+        with self._interpreter_lock:
+            self._interpreter.set_tensor(self._input_index, img_array.astype(np.float32))
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
         
     def preprocess_image(self, img_path: str) -> np.ndarray:
         """
@@ -44,126 +257,219 @@ class BrainTumorClassifier:
         Returns:
             Preprocessed image array
         """
-        img = image.load_img(img_path, target_size=self.img_size)
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = img_array / 255.0  # Normalize to [0, 1]
-        return img_array
+        # The graph writes the (1, 224, 224, 3) batch directly; numpy() shares its buffer
+        return self._tf_preprocess(tf.constant(img_path)).numpy()
+    
+    def preprocess_images(self, img_paths: List[str], batch_size: int = 16) -> tf.data.Dataset:
+        """
+        Preprocess several images as a batched tf.data pipeline
+        
+        Args:
+            img_paths: Paths to the image files
+            batch_size: Number of images per batch
+            
+        Returns:
+            Dataset of (batch, 224, 224, 3) image batches, decoded in parallel
+        """
+        return (
+            tf.data.Dataset.from_tensor_slices(img_paths)
+            .map(lambda img_path: _load_image(img_path, self.img_size), num_parallel_calls=tf.data.AUTOTUNE)
+            .batch(batch_size)
+            .prefetch(tf.data.AUTOTUNE)
+        )
     
     def predict(self, img_path: str) -> Dict:
         """
         Predict brain tumor classification
         
+        Results are cached on disk by image content when cache_dir is set, so
+        repeat uploads of the same scan skip the forward pass.
+        
         Args:
             img_path: Path to the MRI image
             
         Returns:
             Dictionary containing prediction results
         """
+        return self.predict_with_input(img_path)[0]
+    
+    def predict_with_input(self, img_path: str) -> Tuple[Dict, Optional[np.ndarray]]:
+        """
+        Predict brain tumor classification, also returning the preprocessed image
+        
+        Args:
+            img_path: Path to the MRI image
+            
+        Returns:
+            Prediction results, and the preprocessed image for reuse (e.g. by
+            save_gradcam), or None when the result came from the cache
+        """
         if self.model is None:
             self.load_model()
         
-        # Preprocess and predict
+        cache_path = self._prediction_cache_path(img_path)
+        if cache_path is not None:
+            try:
+                with open(cache_path, 'r') as f:
+                    return json.load(f), None
+            except (OSError, ValueError):
+                pass  # Not cached yet (or unreadable), predict below
+        
         img_array = self.preprocess_image(img_path)
-        prediction = self.model.predict(img_array, verbose=0)
+        result = self.predict_array(img_array)
+        
+        if cache_path is not None:
+            # Workers may store the same scan at once; each writes its own temp file
+            _write_atomic(cache_path, json.dumps(result).encode())
         
+        return result, img_array
+    
+    def _prediction_cache_path(self, img_path: str) -> Optional[str]:
+        """Cache file for an image's prediction, keyed by its content and the model version"""
+        if not self.cache_dir:
+            return None
+        
+        digest = blake3(self._model_tag.encode(), max_threads=blake3.AUTO)
+        digest.update_mmap(img_path)
+        return os.path.join(self.cache_dir, f"{digest.hexdigest()}.json")
+    
+    def predict_array(self, img_array: np.ndarray) -> Dict:
+        """
+        Predict brain tumor classification for an already preprocessed image
+        
+        Args:
+            img_array: Image array as returned by preprocess_image
+            
+        Returns:
+            Dictionary containing prediction results
+        """
+        if self.model is None:
+            self.load_model()
+        
+        if self._ort_session is not None:
+            prediction = self._predict_onnx(img_array)
+        elif self._interpreter is not None:
+            prediction = self._predict_tflite(img_array)
+        else:
+            prediction = self._infer(img_array).numpy()
+        
+        return self._to_result(float(prediction[0][0]))
+    
+    def predict_batch(self, img_paths: List[str], batch_size: int = 16) -> List[Dict]:
+        """
+        Predict brain tumor classification for several images at once
+        
+        Args:
+            img_paths: Paths to the MRI images
+            batch_size: Number of images per forward pass
+            
+        Returns:
+            List of prediction results, in the order of img_paths
+        """
+        if self.model is None:
+            self.load_model()
+        
+        results = []
+        for batch in self.preprocess_images(img_paths, batch_size):
+            if self._ort_session is not None:
+                predictions = self._predict_onnx(batch.numpy())
+            elif self._interpreter is not None:
+                # The TFLite model has a fixed batch size of one
+                predictions = [self._predict_tflite(img[np.newaxis])[0] for img in batch.numpy()]
+            else:
+                predictions = self._infer(batch).numpy()
+            results.extend(self._to_result(float(p[0])) for p in predictions)
+        
+        return results
+    
+    def _to_result(self, raw_prediction: float) -> Dict:
+        """Turn the model's sigmoid output into a prediction result"""
         # Get class and confidence
-        pred_class = int(prediction[0][0] > 0.5)
-        confidence = float(prediction[0][0] if pred_class == 1 else 1 - prediction[0][0])
+        pred_class = int(raw_prediction > 0.5)
+        confidence = raw_prediction if pred_class == 1 else 1 - raw_prediction
         
         result = {
             'class': self.class_names[pred_class],
             'confidence': confidence,
             'tumor_detected': pred_class == 1,
-            'raw_prediction': float(prediction[0][0])
+            'raw_prediction': raw_prediction
         }
         
         return result
     
-    def generate_gradcam(self, img_path: str, last_conv_layer_name: str = None) -> np.ndarray:
+    def generate_gradcam(self, img_path: str, last_conv_layer_name: str = None,
+                         img_array: np.ndarray = None) -> np.ndarray:
         """
         Generate Grad-CAM heatmap for explainability
         
         Args:
             img_path: Path to the MRI image
             last_conv_layer_name: Name of the last convolutional layer
+            img_array: Preprocessed image, to skip decoding img_path again
             
         Returns:
-            Heatmap overlay on original image
+            Heatmap overlay on original image (RGB)
         """
+        # Channel-reversed view of the BGR overlay, no copy
+        return self._gradcam_bgr(img_path, last_conv_layer_name, img_array)[:, :, ::-1]
+    
+    def _gradcam_bgr(self, img_path: str, last_conv_layer_name: str = None,
+                     img_array: np.ndarray = None) -> np.ndarray:
+        """Grad-CAM overlay in OpenCV's native BGR channel order"""
         if self.model is None:
             self.load_model()
         
-        # Default layer name for VGG19
-        if last_conv_layer_name is None:
-            last_conv_layer_name = 'block5_conv4'
-        
         # Load and preprocess image
-        img_array = self.preprocess_image(img_path)
+        if img_array is None:
+            img_array = self.preprocess_image(img_path)
         
-        # Create a model that maps the input image to the activations of the last conv layer
-        grad_model = keras.models.Model(
-            self.model.inputs,
-            [self.model.get_layer(last_conv_layer_name).output, self.model.output]
-        )
+        # Heatmap from the compiled forward + backward pass
+        if last_conv_layer_name is None or last_conv_layer_name == GRADCAM_LAYER:
+            gradcam_core = self._gradcam_core
+        else:
+            gradcam_core = _build_gradcam_core(self.model, last_conv_layer_name)
+        heatmap = gradcam_core(tf.convert_to_tensor(img_array, tf.float32)).numpy()
         
-        # Compute gradient of the predicted class with respect to the output feature map
-        with tf.GradientTape() as tape:
-            conv_outputs, predictions = grad_model(img_array)
-            loss = predictions[:, 0]
-        
-        # Extract gradients
-        grads = tape.gradient(loss, conv_outputs)
-        
-        # Global average pooling
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-        
-        # Weight the channels by the corresponding gradients
-        conv_outputs = conv_outputs[0]
-        heatmap = conv_outputs @ pooled_grads[..., tf.newaxis]
-        heatmap = tf.squeeze(heatmap)
-        
-        # Normalize heatmap
-        heatmap = tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)
-        heatmap = heatmap.numpy()
-        
-        # Load original image
-        original_img = cv2.imread(img_path)
-        original_img = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
+        # Load original image, kept in BGR like the colormap and the encoder
+        original_img = cv2.imread(img_path, cv2.IMREAD_COLOR)
         
         # Resize heatmap to match image size
         heatmap = cv2.resize(heatmap, (original_img.shape[1], original_img.shape[0]))
         heatmap = np.uint8(255 * heatmap)
         
-        # Apply colormap
-        heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-        heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
+        # Apply colormap as a single lookup
+        heatmap = self._jet_lut[heatmap]
         
         # Overlay heatmap on original image
         superimposed_img = cv2.addWeighted(original_img, 0.6, heatmap, 0.4, 0)
         
         return superimposed_img
     
-    def save_gradcam(self, img_path: str, output_path: str) -> str:
+    def save_gradcam(self, img_path: str, output_path: str, img_array: np.ndarray = None) -> str:
         """
         Generate and save Grad-CAM visualization
         
         Args:
             img_path: Path to the input MRI image
             output_path: Path to save the Grad-CAM visualization
+            img_array: Preprocessed image, to skip decoding img_path again
             
         Returns:
             Path to the saved visualization
         """
-        gradcam_img = self.generate_gradcam(img_path)
+        gradcam_img = self._gradcam_bgr(img_path, img_array=img_array)
+        
+        # Encode the overlay directly; the format follows the file extension
+        extension = os.path.splitext(output_path)[1].lower()
+        params = []
+        if extension in ('.jpg', '.jpeg'):
+            params = [int(cv2.IMWRITE_JPEG_QUALITY), 90]
+        ok, encoded = cv2.imencode(extension, gradcam_img, params)
+        if not ok:
+            raise IOError(f"Could not encode Grad-CAM visualization for {output_path}")
         
-        plt.figure(figsize=(10, 10))
-        plt.imshow(gradcam_img)
-        plt.axis('off')
-        plt.title('Grad-CAM: Brain Regions Influencing Classification')
-        plt.tight_layout()
-        plt.savefig(output_path, bbox_inches='tight', dpi=150)
-        plt.close()
+        # The file is served while requests may still be asking for it
+        _write_atomic(output_path, encoded.tobytes())
         
         return output_path
 
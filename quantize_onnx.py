@@ -0,0 +1,88 @@
+"""
+Export the classifier to ONNX and quantize it to int8 for the onnx-int8 backend
+Run once after adding the trained model, with a folder of representative MRI scans:
+
+    pip install tf2onnx onnxruntime
+    python quantize_onnx.py path/to/calibration/scans
+"""
+
+import os
+import sys
+import glob
+import tensorflow as tf
+import tf2onnx
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+from config import Config
+from models.classifier import BrainTumorClassifier, onnx_model_path
+
+# Number of calibration scans used to pick the activation ranges
+CALIBRATION_SIZE = 50
+
+
+class MRICalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed MRI scans to the static quantizer, one at a time"""
+    
+    def __init__(self, classifier: BrainTumorClassifier, image_paths, input_name: str):
+        self.classifier = classifier
+        self.image_paths = iter(image_paths)
+        self.input_name = input_name
+    
+    def get_next(self):
+        img_path = next(self.image_paths, None)
+        if img_path is None:
+            return None
+        return {self.input_name: self.classifier.preprocess_image(img_path)}
+
+
+def find_images(folder):
+    """Calibration images in a folder (searched recursively)"""
+    paths = []
+    for ext in Config.ALLOWED_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(folder, '**', f'*.{ext}'), recursive=True))
+    return sorted(paths)[:CALIBRATION_SIZE]
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: python {sys.argv[0]} <calibration image folder>")
+        return 1
+    
+    image_paths = find_images(sys.argv[1])
+    if not image_paths:
+        print(f"❌ No images found in {sys.argv[1]}")
+        return 1
+    
+    classifier = BrainTumorClassifier(Config.MODEL_PATH)
+    classifier.load_model()
+    
+    int8_path = onnx_model_path(Config.MODEL_PATH)
+    float_path = int8_path.replace('_int8.onnx', '.onnx')
+    
+    # Export the float model with a dynamic batch dimension
+    print(f"Exporting model to {float_path}...")
+    input_name = 'input'
+    tf2onnx.convert.from_keras(
+        classifier.model,
+        input_signature=(tf.TensorSpec((None, *classifier.img_size, 3), tf.float32, name=input_name),),
+        opset=15,
+        output_path=float_path
+    )
+    
+    print(f"Quantizing with {len(image_paths)} calibration images to {int8_path}...")
+    quantize_static(
+        float_path,
+        int8_path,
+        MRICalibrationReader(classifier, image_paths, input_name),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True
+    )
+    
+    print("✓ Done. Set CLASSIFIER_BACKEND=onnx-int8 to use the quantized model")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -42,7 +42,6 @@ def check_directories():
         'models',
         'uploads',
         'reports',
-        'static/results',
         'templates'
     ]
     
@@ -0,0 +1,7 @@
+"""
+WSGI entry point for production servers
+
+    gunicorn -k gthread -w 2 --threads 8 -t 120 wsgi:application
+"""
+
+from app import app as application